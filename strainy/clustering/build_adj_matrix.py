@@ -1,6 +1,6 @@
 import logging
 import pandas as pd
-from scipy.spatial.distance import cdist
+from scipy.spatial.distance import cdist, pdist, squareform
 from strainy.params import *
 
 logger = logging.getLogger()
@@ -9,7 +9,7 @@ logger = logging.getLogger()
 
 
 class DistanceWrapper():
-    # Wrapper for calling cdist with custom distance function
+    # Wrapper for calling pdist/cdist with custom distance function
     def __init__(self, cl, data, snp_pos, R, only_with_common_snip):
         self.cl = cl
         self.data = data
@@ -28,6 +28,18 @@ class DistanceWrapper():
 
 
 
+def pairwise_distances(reads, dist_fun):
+    """
+    Square matrix of distances between all reads. The distance is symmetric and
+    zero for a read with itself, so only the pairs i < j are computed
+    """
+    if len(reads) < 2:
+        return cdist(reads, reads, dist_fun)
+    return squareform(pdist(reads, dist_fun))
+
+
+
+
 def build_adj_matrix(cl, data, snp_pos, I, file, edge, R, only_with_common_snip=True):
     """
        Builds an adjacency matrix representing distances between reads in a cluster based on SNP positions.
@@ -41,7 +53,7 @@ def build_adj_matrix(cl, data, snp_pos, I, file, edge, R, only_with_common_snip=
     logger.debug("Building adjacency matrix with " + str(m.shape[1]) + " reads")
     if only_with_common_snip==False:
         dw = DistanceWrapper(cl, data, snp_pos, R, only_with_common_snip)
-        result = cdist(cl['ReadName'].to_frame(), cl['ReadName'].to_frame(), dw.distance_wrapper)
+        result = pairwise_distances(cl['ReadName'].to_frame(), dw.distance_wrapper)
 
         # Set the first row and the column to -1
         try:
@@ -56,7 +68,7 @@ def build_adj_matrix(cl, data, snp_pos, I, file, edge, R, only_with_common_snip=
     else:
 
         dw = DistanceWrapper(cl, data, snp_pos, R, only_with_common_snip)
-        result = cdist(cl['ReadName'].to_frame(), cl['ReadName'].to_frame(), dw.distance_wrapper)
+        result = pairwise_distances(cl['ReadName'].to_frame(), dw.distance_wrapper)
 
         result[0,:] = -1
         result_df = pd.DataFrame(result, 
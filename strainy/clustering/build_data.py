@@ -4,6 +4,7 @@ import os
 import io
 import re
 from collections import Counter, namedtuple
+from functools import lru_cache
 from Bio import SeqIO
 from strainy.params import *
 import logging
@@ -32,9 +33,17 @@ def read_snp(vcf_file, edge, bam, AF, cluster=None):
     snp_pos = []
     if vcf_file == None:
         if cluster == None:
-            snpos = ('bcftools mpileup -r {} {} --no-reference -I --no-version --annotate FORMAT/AD --annotate FORMAT/ADR --annotate FORMAT/ADF   2>/dev/null | bcftools query -f  "%CHROM %POS [ %AD %DP %ADR %ADF  %REF %ALT]\n"  >{}/vcf/vcf_{}.txt').format(edge, bam, StRainyArgs().output_intermediate, edge)
-
-            subprocess.check_output(snpos, shell=True, capture_output=False)
+            mpileup_cmd = ["bcftools", "mpileup", "-r", edge, bam, "--no-reference", "-I", "--no-version",
+                           "--annotate", "FORMAT/AD", "--annotate", "FORMAT/ADR", "--annotate", "FORMAT/ADF"]
+            query_cmd = ["bcftools", "query", "-f", "%CHROM %POS [ %AD %DP %ADR %ADF  %REF %ALT]\n"]
+
+            with open("%s/vcf/vcf_%s.txt" % (StRainyArgs().output_intermediate, edge), "w") as vcf_txt:
+                mpileup_proc = subprocess.Popen(mpileup_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                query_proc = subprocess.run(query_cmd, stdin=mpileup_proc.stdout, stdout=vcf_txt)
+                mpileup_proc.stdout.close()
+                mpileup_proc.wait()
+            if query_proc.returncode != 0:
+                raise subprocess.CalledProcessError(query_proc.returncode, query_cmd)
             filtered_file='{}/vcf/vcf_{}_filtered.vcf'.format(StRainyArgs().output_intermediate, edge)
             if not os.path.exists(filtered_file):
                 vcf_file_f = open(filtered_file, "a+")
@@ -79,8 +88,8 @@ def read_snp(vcf_file, edge, bam, AF, cluster=None):
         else:
             raise Exception("Shouldn't happen")
     else:
-        bcftools_cmd = f"bcftools view -f PASS -H {vcf_file} {edge} --types snps"
-        bcf_proc = subprocess.Popen(bcftools_cmd, shell=True, stdout=subprocess.PIPE)
+        bcftools_cmd = ["bcftools", "view", "-f", "PASS", "-H", vcf_file, edge, "--types", "snps"]
+        bcf_proc = subprocess.Popen(bcftools_cmd, stdout=subprocess.PIPE)
         for line in io.TextIOWrapper(bcf_proc.stdout, encoding="utf-8"):
             snp_pos.append(line.split()[1])
     return snp_pos
@@ -256,12 +265,26 @@ def read_bam(bam, edge, snp_pos, min_mapping_quality,min_base_quality, min_al_le
 
 
 
+@lru_cache(maxsize=None)
+def unitig_coverage(bam, edge):
+    """
+    Returns the number of covered bases and the mean depth of the unitig, as reported by samtools coverage.
+    Cached per process, as these are requested for the same unitig at several stages
+    """
+    stats = pysam.samtools.coverage("-r", edge, bam, "--no-header").split()
+    return int(stats[4]), float(stats[6])
+
+
+@lru_cache(maxsize=1)
+def _load_fasta_seqs(filename):
+    """
+    Parses the fasta file once per process, subsequent lookups are dictionary accesses
+    """
+    return {seq.id: str(seq.seq) for seq in SeqIO.parse(filename, "fasta")}
+
+
 def read_fasta_seq(filename, seq_name):
-    reference_seq = None
-    for seq in SeqIO.parse(filename, "fasta"):
-        if seq.id == seq_name:
-            reference_seq = str(seq.seq)
-            break
+    reference_seq = _load_fasta_seqs(filename).get(seq_name)
     if reference_seq is None:
         raise Exception("Reference sequence not found")
 
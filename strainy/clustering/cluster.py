@@ -6,7 +6,6 @@ import matplotlib as mt
 logging.getLogger('matplotlib.font_manager').disabled = True
 import multiprocessing
 import pandas as pd
-import pysam
 from strainy.clustering.community_detection import find_communities
 from strainy.clustering.cluster_postprocess import postprocess
 from strainy.clustering import build_data as build_data
@@ -44,8 +43,7 @@ def clusters_vis_stats(G, cl, clN, uncl, edge, I):
     except AttributeError:  #incompatability with scipy < 1.8
         pass
 
-    ln = pysam.samtools.coverage("-r", edge, StRainyArgs().bam, "--no-header").split()[4]
-    cov = pysam.samtools.coverage("-r", edge, StRainyArgs().bam, "--no-header").split()[6]
+    ln, cov = build_data.unitig_coverage(StRainyArgs().bam, edge)
     plt.suptitle(str(edge) + " coverage:" + str(cov) + " length:" + str(ln) + " clN:" + str(clN))
     plt.savefig("%s/graphs/graph_%s_%s_%s.png" % (StRainyArgs().output_intermediate, edge, I, StRainyArgs().AF), format="PNG", dpi=300)
     plt.close()
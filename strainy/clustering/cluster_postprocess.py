@@ -1,5 +1,6 @@
 import networkx as nx
 import logging
+import numpy as np
 import pandas as pd
 from strainy.clustering.community_detection import find_communities
 from strainy.clustering import build_adj_matrix as matrix
@@ -99,16 +100,15 @@ def build_adj_matrix_clusters(edge,cons,cl,flye_consensus,
     for i in sorted(sort, key = lambda sort: [sort[2], sort[1]]):
         sorted_by_pos.append(i[0])
     clusters = sorted(set(sorted_by_pos) & set(clusters), key = sorted_by_pos.index)
-    m = pd.DataFrame(-1.0, index = clusters, columns = clusters)
-
-    for i in range(0, m.shape[1]):
-        first_cl = m.index[i]
-        for k in range(i + 1, m.shape[1]):
-            second_cl = m.index[k]
-
-            if m[second_cl][first_cl] == -1:
-                m.loc[first_cl, second_cl] = matrix.distance_clusters\
-                    (edge, first_cl, second_cl, cons, cl,flye_consensus, only_with_common_snip)
+    # only the upper triangle is filled, each pair of clusters is compared once
+    dist = np.full((len(clusters), len(clusters)), -1.0)
+    for i in range(0, len(clusters)):
+        first_cl = clusters[i]
+        for k in range(i + 1, len(clusters)):
+            second_cl = clusters[k]
+            dist[i, k] = matrix.distance_clusters\
+                (edge, first_cl, second_cl, cons, cl,flye_consensus, only_with_common_snip)
+    m = pd.DataFrame(dist, index = clusters, columns = clusters)
     return m
 
 
@@ -121,7 +121,6 @@ def join_clusters(cons, cl, Rcl, edge, consensus,only_with_common_snip=True,
     Returns:
         pd.DataFrame: The updated DataFrame `cl` with refined cluster assignments after merging.
     """
-    MAX_VIS_SIZE = 500
     CUT_OFF=3
 
     if only_with_common_snip is False:
@@ -145,7 +144,7 @@ def join_clusters(cons, cl, Rcl, edge, consensus,only_with_common_snip=True,
 
     G_vis.remove_edges_from(list(nx.selfloop_edges(G_vis)))
 
-    if StRainyArgs().debug and max(G_vis.number_of_nodes(), G_vis.number_of_edges()) < MAX_VIS_SIZE:
+    if StRainyArgs().debug and max(G_vis.number_of_nodes(), G_vis.number_of_edges()) < max_vis_graph_size:
         G_vis_before = nx.nx_agraph.to_agraph(G_vis)
         G_vis_before.layout(prog = "dot")
         G_vis_before.draw(f"{StRainyArgs().output_intermediate}/graphs/linear_phase_{edge}.png")
@@ -179,7 +178,7 @@ def join_clusters(cons, cl, Rcl, edge, consensus,only_with_common_snip=True,
             to_remove.append(i)
     G_vis.remove_edges_from(ebunch = to_remove)
 
-    if StRainyArgs().debug and max(G_vis.number_of_nodes(), G_vis.number_of_edges()) < MAX_VIS_SIZE:
+    if StRainyArgs().debug and max(G_vis.number_of_nodes(), G_vis.number_of_edges()) < max_vis_graph_size:
         G_vis = nx.nx_agraph.to_agraph(G_vis)
         G_vis.layout(prog="dot")
         G_vis.draw(f"{StRainyArgs().output_intermediate}/graphs/linear_phase_simplified_{edge}.png")
@@ -3,15 +3,13 @@ import traceback
 import subprocess
 import os
 import shutil
-import random
+import tempfile
 import logging
 import sys
 
 import edlib
 import pysam
 from Bio import SeqIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
 from argparse import Namespace
 
 from strainy.params import *
@@ -43,8 +41,18 @@ class FlyeConsensus:
         self._consensus_dict = multiproc_manager.dict(consensus_dict)
         self._alignment_cache= multiproc_manager.dict()
 
+        # process-local copy of the consensus entries of the edge that is currently processed,
+        # so that repeated requests do not go through the manager process
+        self._local_edge = None
+        self._local_consensus = {}
+        # hits served from the process-local copy, added to the shared counter once per edge
+        self._local_hits = 0
+
         self._bam_path = bam_file_name
-        self._read_index = None
+        self._bam = None    # opened lazily, once per process
+        # (name, start, end) of all alignments of the last edge fetched by this process
+        self._span_edge = None
+        self._edge_spans = []
         self._unitig_seqs = {}
         for seq in SeqIO.parse(graph_fasta_name, "fasta"):
             self._unitig_seqs[str(seq.id)] = str(seq.seq)
@@ -55,11 +63,15 @@ class FlyeConsensus:
         if StRainyArgs().mode == "hifi":
             self._platform = "pacbio"
             self._read_type = "hifi"
-            self._mode = "--pacbio-hifi"
         elif StRainyArgs().mode == "nano":
             self._platform = "nano"
             self._read_type = "raw"
-            self._mode = "--nano-raw"
+
+        # polisher arguments that are the same for every cluster
+        self._polish_args = {"num_iters": 1,
+                             "threads": 1,
+                             "platform": self._platform,
+                             "read_type": self._read_type}
 
         self._key_hit = multiproc_manager.Value("i", 0)
         self._key_miss = multiproc_manager.Value("i", 0)
@@ -75,11 +87,40 @@ class FlyeConsensus:
         self._alignment_cache_miss = multiproc_manager.Value("i", 0)
 
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_local_edge"] = None
+        state["_local_consensus"] = {}
+        state["_local_hits"] = 0
+        state["_bam"] = None
+        state["_span_edge"] = None
+        state["_edge_spans"] = []
+        return state
+
+
+    def _get_bam(self):
+        if self._bam is None:
+            self._bam = pysam.AlignmentFile(self._bam_path, "rb")
+        return self._bam
+
+
     def get_consensus_dict(self):
         return self._consensus_dict.copy()
 
 
+    def flush_local_statistics(self):
+        """
+        Adds the hits served from the process-local copy to the shared counter.
+        Called when the processed edge changes and at the end of each worker task
+        """
+        if self._local_hits:
+            with self._lock:
+                self._key_hit.value += self._local_hits
+            self._local_hits = 0
+
+
     def print_cache_statistics(self):
+        self.flush_local_statistics()
         logger.info(f"Total number of key hits and misses for consensus computation:")
         logger.info(f" H:{self._key_hit.value}, M:{self._key_miss.value}")
         logger.info(f"Position hit/miss")
@@ -88,40 +129,118 @@ class FlyeConsensus:
         logger.info(f" H:{self._alignment_cache_hit.value}, M:{self._alignment_cache_miss.value}")
 
 
+    def _make_work_dir(self, edge, cluster, use_tmp=True):
+        """
+        Creates the directory for the polisher inputs and outputs of a cluster.
+        Returns the directory and whether it was placed under flye_tmp_dir
+        """
+        prefix = f"{edge}_cluster{cluster}_"
+        if use_tmp and delete_flye_files and flye_tmp_dir:
+            try:
+                return tempfile.mkdtemp(prefix=prefix, dir=flye_tmp_dir), True
+            except OSError as e:
+                logger.warning(f"Could not create a directory in {flye_tmp_dir}, using the output directory: {e}")
+        disk_dir = os.path.join(StRainyArgs().output_intermediate, "flye_inputs")
+        os.makedirs(disk_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=prefix, dir=disk_dir), False
+
+
+    def _move_to_disk(self, work_dir, edge, cluster, read_names, start_pos):
+        """
+        Replaces a work directory under flye_tmp_dir with one in the output directory
+        and extracts the reads of the cluster there again.
+        Returns the new directory, whether it is in flye_tmp_dir (False) and the path of the extracted bam
+        """
+        shutil.rmtree(work_dir, ignore_errors=True)
+        work_dir, in_tmp = self._make_work_dir(edge, cluster, use_tmp=False)
+        bam_subset_sorted = os.path.join(work_dir, "reads_sorted.bam")
+        self._extract_reads(read_names, start_pos, bam_subset_sorted, edge)
+        return work_dir, in_tmp, bam_subset_sorted
+
+
+    def _polish(self, work_dir, edge, cluster, ref_seq_cut, bam_subset_sorted):
+        """
+        Runs the Flye polisher on the extracted reads of a cluster against the cut unitig sequence.
+        Returns the polished sequence (None if the polisher failed, '' if its output could not be read)
+        and the polisher output directory. OSError is raised if the polisher input cannot be written
+        """
+        fname = os.path.join(work_dir, f"{edge}-cluster{cluster}")
+        flye_out_dir = os.path.join(work_dir, "flye_output")
+        with open(f"{fname}.fa", "w") as f:
+            f.write(f">{edge}\n{ref_seq_cut}\n")
+
+        try:
+            # index the bam file, reads are already written in sorted order
+            pysam.index(bam_subset_sorted)
+        except pysam.utils.SamtoolsError  as e:
+            logger.error(f'Error while indexing {bam_subset_sorted}')
+            logger.error(traceback.format_exc())
+
+        #  Polisher arguments for to call _run_polisher_only(polish_args)
+        polish_args = Namespace(polish_target=f"{fname}.fa",
+                                reads=[bam_subset_sorted],
+                                out_dir=flye_out_dir,
+                                **self._polish_args)
+        try:
+            logger.debug("Running Flye polisher")
+            os.mkdir(polish_args.out_dir)
+            _run_polisher_only(polish_args, output_progress=False)
+            logger.debug("Running Flye polisher - finished!")
+        except Exception as e:
+            logger.error("Error running the Flye polisher. Make sure the fasta file contains only the primary alignments")
+            logger.error(e)
+            return None, flye_out_dir
+
+        try:
+            # read back the output of the Flye polisher, which should contain a single record
+            with open(os.path.join(flye_out_dir, "polished_1.fasta")) as f:
+                records = f.read().split(">")[1:]
+            if len(records) != 1:
+                raise ValueError(f"Expected a single polished sequence, found {len(records)}")
+            consensus_seq = "".join(records[0].splitlines()[1:])
+        except (OSError, ValueError) as e:
+            # If there is an error, the sequence string is set to empty by default
+            logger.warning("WARNING: error reading back the flye output, defaulting to empty sequence for consensus")
+            logger.warning(e)
+            consensus_seq = ''
+        if not consensus_seq:
+            logger.warning(f"Empty polished consensus for cluster {cluster} of {edge}")
+        return consensus_seq, flye_out_dir
+
+
     def _extract_reads(self, read_names, start_pos, output_file, edge=""):
         """
         based on the code by Tim Stuart https://timoast.github.io/blog/2015-10-12-extractreads/
-        Extract the reads given query names to a new bam file
+        Extract the reads given query names to a new coordinate-sorted bam file
         """
         cluster_start = -1
         cluster_end = -1
         read_limits = []
 
-        read_list = []  # stores the reads to be written after the cluster start/end is calculated
-
-        if self._read_index is None:
-            self._read_index = pysam.IndexedReads(pysam.AlignmentFile(self._bam_path, "rb"))
-            self._read_index.build()
-
-        for i, name in enumerate(read_names):
-            iterator = self._read_index.find(name)
-            for x in iterator:
-                if x.reference_name == edge and x.reference_start == start_pos[i]:
-                    if x.reference_start < cluster_start or cluster_start == -1:
-                        cluster_start = x.reference_start
-                    if x.reference_end > cluster_end or cluster_end == -1:
-                        cluster_end = x.reference_end
-                    read_list.append(x)
-                    read_limits.append((x.reference_start, x.reference_end))
-
-        out = pysam.Samfile(output_file, "wb", template=pysam.AlignmentFile(self._bam_path, "rb"))
-        for x in read_list:
-            temp_dict = x.to_dict()
-            temp_dict["ref_pos"] = str(int(temp_dict["ref_pos"]) - cluster_start)
-            y = x.from_dict(temp_dict, x.header)  # create a new read from the modified dictionary
-            out.write(y)
-
-        out.close()
+        # a read may have several alignments, only the one starting at the recorded position is taken
+        selected = set(zip(read_names, map(int, start_pos)))
+
+        bam = self._get_bam()
+        # first pass: cluster boundaries only. The alignment spans are shared by all clusters of the edge,
+        # so they are fetched once per edge, the reads themselves are not kept in memory
+        if edge != self._span_edge:
+            self._edge_spans = [(x.query_name, x.reference_start, x.reference_end) for x in bam.fetch(edge)]
+            self._span_edge = edge
+        for name, start, end in self._edge_spans:
+            if (name, start) in selected:
+                if start < cluster_start or cluster_start == -1:
+                    cluster_start = start
+                if end > cluster_end or cluster_end == -1:
+                    cluster_end = end
+                read_limits.append((start, end))
+
+        # second pass: shift the reads to the cut reference and stream them out.
+        # fetch returns the alignments of the edge in coordinate order, so the output bam is sorted
+        with pysam.AlignmentFile(output_file, "wb", template=bam) as out:
+            for x in bam.fetch(edge):
+                if (x.query_name, x.reference_start) in selected:
+                    x.reference_start -= cluster_start
+                    out.write(x)
 
         return cluster_start, cluster_end, read_limits
     
@@ -147,128 +266,123 @@ class FlyeConsensus:
         cl: dataframe with columns read_name and cluster(id)
         edge: edge name (str)
         """
+        if edge != self._local_edge:
+            self.flush_local_statistics()
+            self._local_edge = edge
+            self._local_consensus = {}
+        if cluster in self._local_consensus:
+            self._local_hits += 1
+            return self._local_consensus[cluster]
+
         # check if the output for this cluster-edge pair exists in the cache
         consensus_dict_key = f"{cluster}-{edge}"
         with self._lock:
-            if consensus_dict_key in self._consensus_dict:
+            cached = self._consensus_dict.get(consensus_dict_key)
+            if cached is not None:
                 self._key_hit.value += 1
-                return self._consensus_dict[consensus_dict_key]
+                self._local_consensus[cluster] = cached
+                return cached
             self._key_miss.value += 1
 
         # fetch the read names in this cluster and extract those reads to a new bam file to be used by the
         # Flye polisher
-        reads_from_curr_cluster = cl.loc[cl["Cluster"] == cluster]["ReadName"].to_numpy()  # store read names
-        start_pos_of_reads = cl.loc[cl["Cluster"] == cluster]["Start"].to_numpy()
-        salt = random.randint(1000, 10000)
-        fprefix = "%s/flye_inputs/" % StRainyArgs().output_intermediate
-        bam_subset = f"{fprefix}{edge}_cluster_{cluster}_reads_{salt}.bam"
-        bam_subset_sorted = f"{fprefix}{edge}_cluster_{cluster}_reads_{salt}_sorted.bam"
-        cluster_start, cluster_end, read_limits = self._extract_reads(reads_from_curr_cluster, start_pos_of_reads,
-                                                                      bam_subset, edge)
-
-        logger.debug((f"CLUSTER:{cluster}, CLUSTER_START:{cluster_start}, CLUSTER_END:{cluster_end}, EDGE:{edge},"
-               f"# OF READS:{len(reads_from_curr_cluster)}"))
-
-        # access the edge in the graph and cut its sequence according to the cluster start and end positions
-        # this sequence is written to a fasta file to be used by the Flye polisher
-        ref_seq_cut = self._unitig_seqs[edge][cluster_start:cluster_end]
-        fname = f"{fprefix}{edge}-cluster{cluster}-{salt}"
-        record = SeqRecord(
-            Seq(ref_seq_cut),
-            id=f"{edge}",
-            name=f"{edge} sequence cut for cluster {cluster}",
-            description=""
-        )
-        SeqIO.write([record], f"{fname}.fa", "fasta")
-
-        try:
-            # sort the bam file
-            pysam.sort("-o", bam_subset_sorted, bam_subset)
-            # index the bam file
-            pysam.index(bam_subset_sorted)
-        except pysam.utils.SamtoolsError  as e:
-            logger.error(f'Error while sorting {bam_subset_sorted}')
-            logger.error(traceback.format_exc())
-
-        #  Polisher arguments for to call _run_polisher_only(polish_args)
-        flye_out_dir = f"{StRainyArgs().output_intermediate}/flye_outputs/flye_consensus_{edge}_{cluster}_{salt}"
-        polish_args = Namespace(polish_target=f"{fname}.fa",
-                                reads=[bam_subset_sorted],
-                                out_dir=flye_out_dir,
-                                num_iters=1,
-                                threads=1,
-                                platform=self._platform,
-                                read_type=self._read_type)
-
-        # polish_cmd = f"{StRainyArgs().flye} --polish-target {fname}.fa --threads {self._num_processes}" \
-        #              f" {self._mode} {fprefix}cluster_{cluster}_reads_sorted_{salt}.bam " \
-        #              f"-o {StRainyArgs().output_intermediate}/flye_outputs/flye_consensus_{edge}_{cluster}_{salt}"
+        cluster_rows = cl.loc[cl["Cluster"] == cluster, ["ReadName", "Start"]]
+        reads_from_curr_cluster = cluster_rows["ReadName"].to_numpy()  # store read names
+        start_pos_of_reads = cluster_rows["Start"].to_numpy()
+        # all inputs and outputs of the polisher for this cluster are kept in a single directory,
+        # which is removed afterwards unless the files are to be kept for inspection
+        work_dir, in_tmp = self._make_work_dir(edge, cluster)
         try:
-            logger.debug("Running Flye polisher")
-            # subprocess.check_output(polish_cmd, shell=True, capture_output=False, stderr=open(os.devnull, "w"))
-            # TODO: this should move to the top when flye pull request is merged
-            if not os.path.isdir(polish_args.out_dir):
-                os.mkdir(polish_args.out_dir)
-            _run_polisher_only(polish_args, output_progress=False)
-            logger.debug("Running Flye polisher - finished!")
-        except Exception as e:
-            logger.error("Error running the Flye polisher. Make sure the fasta file contains only the primary alignments")
-            logger.error(e)
-            with self._lock:
-                self._consensus_dict[consensus_dict_key] = {
-                    'consensus': Seq(''),
+            bam_subset_sorted = os.path.join(work_dir, "reads_sorted.bam")
+            try:
+                cluster_start, cluster_end, read_limits = self._extract_reads(reads_from_curr_cluster,
+                                                                              start_pos_of_reads,
+                                                                              bam_subset_sorted, edge)
+            except OSError as e:
+                # e.g. a small tmpfs is full, the reads are extracted again on disk
+                if not in_tmp:
+                    raise
+                logger.warning(f"Could not write to {work_dir}, using the output directory: {e}")
+                work_dir, in_tmp, bam_subset_sorted = self._move_to_disk(work_dir, edge, cluster,
+                                                                         reads_from_curr_cluster,
+                                                                         start_pos_of_reads)
+
+            logger.debug((f"CLUSTER:{cluster}, CLUSTER_START:{cluster_start}, CLUSTER_END:{cluster_end}, EDGE:{edge},"
+                   f"# OF READS:{len(reads_from_curr_cluster)}"))
+
+            # access the edge in the graph and cut its sequence according to the cluster start and end positions
+            # this sequence is written to a fasta file to be used by the Flye polisher
+            ref_seq_cut = self._unitig_seqs[edge][cluster_start:cluster_end]
+
+            # polishing is not informative for such small clusters, the unitig sequence is used instead.
+            # the bed content mimics Flye's coverage output over the cut sequence
+            if len(read_limits) < min_polish_reads:
+                consensus_entry = {
+                    'consensus': ref_seq_cut,
                     'start': cluster_start,
-                    'end': cluster_end
+                    'end': cluster_end,
+                    'read_limits': read_limits,
+                    'bed_content': [[0, cluster_end - cluster_start, len(read_limits)]]
                 }
-                return self._consensus_dict[consensus_dict_key]
-
-        try:
-            # read back the output of the Flye polisher
-            consensus = SeqIO.read(os.path.join(flye_out_dir, "polished_1.fasta"), "fasta")
-        except (ImportError, ValueError) as e:
-            # If there is an error, the sequence string is set to empty by default
-            logger.warning("WARNING: error reading back the flye output, defaulting to empty sequence for consensus")
-            if type(e).__name__ == 'ImportError':
-                logger.warning('found ImportError')
-            consensus = SeqRecord(
-                seq=''
-            )
+                with self._lock:
+                    self._consensus_dict[consensus_dict_key] = consensus_entry
+                self._local_consensus[cluster] = consensus_entry
+                return consensus_entry
 
-        bed_content = self._parse_bed_coverage(os.path.join(flye_out_dir, "base_coverage.bed.gz"))
-
-        # delete the created input files to Flye
-        if delete_flye_files:
             try:
-                os.remove(f"{fname}.fa")
-                os.remove(bam_subset)
-                os.remove(bam_subset_sorted)
-                os.remove(bam_subset_sorted + ".bai")
-                shutil.rmtree(flye_out_dir)
-            except (OSError, FileNotFoundError):
-                pass
-
-        start, end, consensus_clipped = self._clip_consensus_seq(consensus.seq, 
+                consensus_seq, flye_out_dir = self._polish(work_dir, edge, cluster, ref_seq_cut, bam_subset_sorted)
+            except OSError as e:
+                if not in_tmp:
+                    raise
+                logger.warning(f"Could not write the polisher input to {work_dir}: {e}")
+                consensus_seq = None
+            if not consensus_seq and in_tmp:
+                # a full or unwritable tmpfs makes the polisher fail, it is run again on disk
+                logger.warning(f"No polished consensus in {work_dir}, polishing again in the output directory")
+                work_dir, in_tmp, bam_subset_sorted = self._move_to_disk(work_dir, edge, cluster,
+                                                                         reads_from_curr_cluster,
+                                                                         start_pos_of_reads)
+                consensus_seq, flye_out_dir = self._polish(work_dir, edge, cluster, ref_seq_cut, bam_subset_sorted)
+
+            if consensus_seq is None:
+                consensus_entry = {
+                    'consensus': '',
+                    'start': cluster_start,
+                    'end': cluster_end
+                }
+                with self._lock:
+                    self._consensus_dict[consensus_dict_key] = consensus_entry
+                self._local_consensus[cluster] = consensus_entry
+                return consensus_entry
+
+            bed_content = self._parse_bed_coverage(os.path.join(flye_out_dir, "base_coverage.bed.gz"))
+        finally:
+            # delete the created input and output files of Flye
+            if delete_flye_files:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        start, end, consensus_clipped = self._clip_consensus_seq(consensus_seq, 
                                                                  read_limits, 
                                                                  bed_content,
                                                                  cluster_start,
                                                                  2)
+        consensus_entry = {
+            'consensus': consensus_clipped,
+            'start': start,
+            'end': end,
+            'read_limits': read_limits,
+            'bed_content': bed_content
+
+        }
         with self._lock:
-            self._consensus_dict[consensus_dict_key] = {
-                'consensus': consensus_clipped,
-                'start': start,
-                'end': end,
-                'read_limits': read_limits,
-                'bam_path': bam_subset,
-                'reference_path': f"{fname}.fa",
-                'reference_seq': self._unitig_seqs[edge],
-                'bed_content': bed_content
-
-            }
-            return self._consensus_dict[consensus_dict_key]
+            self._consensus_dict[consensus_dict_key] = consensus_entry
+        self._local_consensus[cluster] = consensus_entry
+        return consensus_entry
 
 
     def _edlib_align(self, seq_a, seq_b):
-        band_size = 32
+        # the edit distance is at least the length difference, so smaller bands are bound to fail
+        band_size = max(32, abs(len(seq_a) - len(seq_b)))
         aln = None
         while True:
             aln = edlib.align(seq_a, seq_b, "NW", "path", band_size)
@@ -322,6 +436,9 @@ class FlyeConsensus:
         cl1_bed_contents = first_cl_dict['bed_content']
         cl2_bed_contents = second_cl_dict['bed_content']
 
+        # number of gaps in aligned_first[:i] and aligned_second[:i], updated as the alignment is scanned
+        first_gaps = 0
+        second_gaps = 0
 
         for i, base in enumerate(alignment_list):
             if base not in "-.|":
@@ -330,8 +447,12 @@ class FlyeConsensus:
             # true coordinate = current coordinate on the alignment_string
             # + start of the intersection
             # - gaps in the target (or query) sequence thus far
-            cl1_true_coor = first_shift + i - aligned_first[:i].count('-')
-            cl2_true_coor = second_shift + i - aligned_second[:i].count('-')
+            cl1_true_coor = first_shift + i - first_gaps
+            cl2_true_coor = second_shift + i - second_gaps
+            if aligned_first[i] == '-':
+                first_gaps += 1
+            if aligned_second[i] == '-':
+                second_gaps += 1
 
             # ignore variants with low coverage
             if ((base == '-' or base == '.')
@@ -444,10 +565,14 @@ class FlyeConsensus:
         intersection_start = max(first_cl_dict['start'], second_cl_dict['start'])
         intersection_end = min(first_cl_dict['end'], second_cl_dict['end'])
 
+        # consensus sequences are cached as str, which edlib encodes without per-character Python overhead
+        first_consensus = first_cl_dict['consensus']
+        second_consensus = second_cl_dict['consensus']
+
         # clip the intersecting parts of both consensus'
-        first_consensus_clipped = first_cl_dict['consensus'][
+        first_consensus_clipped = first_consensus[
                                   intersection_start - first_cl_dict['start']:intersection_end - first_cl_dict['start']]
-        second_consensus_clipped = second_cl_dict['consensus'][
+        second_consensus_clipped = second_consensus[
                                    intersection_start - second_cl_dict['start']:intersection_end - second_cl_dict['start']]
 
         if (intersection_end - intersection_start < 1
@@ -456,7 +581,12 @@ class FlyeConsensus:
             logger.debug(f'Intersection length for clusters is less than 1 for clusters {first_cl}, {second_cl} in {edge}')
             return 1
 
-        reference_seq = first_cl_dict['reference_seq']
+        # identical sequences align without mismatches or indels, so the custom score is 0
+        # and neither alignment needs to be computed
+        if first_consensus_clipped == second_consensus_clipped:
+            return 0
+
+        reference_seq = self._unitig_seqs[edge]
         aligned_first, aligned_second, edlib_aln = self._edlib_align(first_consensus_clipped, second_consensus_clipped)
 
         
@@ -475,7 +605,7 @@ class FlyeConsensus:
                 first_cl_to_ref, reference_aligned =  self._alignment_cache[cache_key]
         else:
             self._alignment_cache_miss.value += 1
-            first_cl_to_ref, reference_aligned, _ = self._edlib_align(first_cl_dict['consensus'], reference_seq[first_cl_dict['start']:first_cl_dict['end']])
+            first_cl_to_ref, reference_aligned, _ = self._edlib_align(first_consensus, reference_seq[first_cl_dict['start']:first_cl_dict['end']])
             # cache the reference alignment for re-use
             with self._lock:
                 self._alignment_cache[cache_key] = [first_cl_to_ref, reference_aligned]
@@ -1,4 +1,6 @@
 import logging
+import numpy as np
+import pandas as pd
 from strainy.graph_operations import gfa_ops
 from strainy.unitig_statistics import utg_stats
 from strainy.clustering import build_data
@@ -11,6 +13,7 @@ This contains functions for operation with assembly graph:
 3. change_cov: recalculate coverage of parent unitig
 4. change_sec: recalculate sequence of parent unitig
 5. strong_tail: determines whether a cluster has strong coverage at both the start and end of a segment
+6. read_positions: collects the alignment start and end of reads in a DataFrame
 """
 
 
@@ -18,7 +21,8 @@ logger = logging.getLogger()
 
 
 
-def add_child_edge(edge, clN, g, cl, left, right, cons, flye_consensus, change_seq=True, insertmain=True):
+def add_child_edge(edge, clN, g, cl, left, right, cons, flye_consensus, change_seq=True, insertmain=True,
+                   consensus=None, parent=None):
     """
     Adds a child unitig with the same sequence as the parental unitig or with the given sequence
     This function uses `flye_consensus` to compute the consensus sequence for the unitig and constructs
@@ -32,16 +36,20 @@ def add_child_edge(edge, clN, g, cl, left, right, cons, flye_consensus, change_s
     -If  `insertmain` is set `True`, then sequence gaps (if any) are filled with the parent unitig sequence.
     It happens when the consensus is shorter than the cluster boundaries (left and right)
     - This function is designed to work with the `gfa_ops.add_edge` function to handle edge insertion in the GFA graph.
+    - `consensus` can be passed if it was already computed for this cluster, otherwise it is taken from `flye_consensus`.
+    - `parent` can be passed if the parental segment was already looked up, otherwise it is taken from `g`.
     """
-    consensus = flye_consensus.flye_consensus(clN, edge, cl)
+    if consensus is None:
+        consensus = flye_consensus.flye_consensus(clN, edge, cl)
+    if parent is None:
+        parent = g.try_get_segment(edge)
     consensus_start = consensus["start"]
     cons_length_diff = len(consensus["consensus"]) - (consensus["end"] - consensus["start"])
     logger.debug(f'Consensus length difference: {cons_length_diff}')
 
     if change_seq == True:
         if consensus_start > left and insertmain == True:
-            main_seq = g.try_get_segment(edge)
-            insert = main_seq.sequence[left:consensus_start]
+            insert = parent.sequence[left:consensus_start]
             seq = str(consensus["consensus"])[0: right - consensus_start + cons_length_diff + 1]
             seq = insert + seq
         else:
@@ -49,7 +57,7 @@ def add_child_edge(edge, clN, g, cl, left, right, cons, flye_consensus, change_s
         if len(seq) == 0: ##TODO: investigate when it happens
             seq = "A"
     else:
-        seq = g.try_get_segment("%s" % edge).sequence
+        seq = parent.sequence
     cov= round(cons[clN]["Cov"])
     name=str(edge) + "_" + str(clN)
     new_line = gfa_ops.add_edge(g, name,cov, seq)
@@ -70,11 +78,12 @@ def add_path_links(graph, edge, paths):
     This function iterates through the provided paths (each representing a series of unitigs) and creates
     links between consecutive unitigs. These links are added to the graph using the `gfa_ops.add_link`
     function, which represents the connections between unitigs in a GFA.
+    Consecutive pairs shared by several paths are linked only once.
     Returns: None: This function modifies the graph in place by adding links between unitigs.
     """
-    for path in paths:
-        for i in range(0, len(path) - 1):
-            gfa_ops.add_link(graph, f"{edge}_{path[i]}", "+", f"{edge}_{path[i + 1]}", "+", 1)
+    pairs = dict.fromkeys((path[i], path[i + 1]) for path in paths for i in range(0, len(path) - 1))
+    for fr, to in pairs:
+        gfa_ops.add_link(graph, f"{edge}_{fr}", "+", f"{edge}_{to}", "+", 1)
 
 
 
@@ -89,12 +98,11 @@ def change_cov(g, edge, cons, ln, clusters, othercl, remove_clusters):
     graph.
     """
     cov = 0
-    len_cl = []
+    covered = np.zeros(max([ln] + [cons[i]["End"] for i in othercl]), dtype=bool)
     for i in othercl:
         cov += cons[i]["Cov"] * (cons[i]["End"] - cons[i]["Start"])
-        for i in range(cons[i]["Start"],cons[i]["End"]):
-            len_cl.append(i)
-    if (len(set(len_cl)) / ln) < parental_min_len and len(clusters)- len(othercl) != 0:
+        covered[cons[i]["Start"]:cons[i]["End"]] = True
+    if (np.count_nonzero(covered) / ln) < parental_min_len and len(clusters)- len(othercl) != 0:
         remove_clusters.add(edge)
     cov = cov / ln
     i = g.try_get_segment(edge)
@@ -134,7 +142,18 @@ def change_sec(g, edge, othercl, cl,SNP_pos, data, cut = True):
 
 
 
-def strong_tail(cluster, cl, ln, data):
+def read_positions(data, reads):
+    """
+    Collects the alignment start and end positions of the given reads in a single pass over `data`.
+    Returns: pd.DataFrame indexed by read name, with "Start" and "End" columns.
+    """
+    return pd.DataFrame.from_dict({read: (data[read]["Start"], data[read]["End"]) for read in reads},
+                                  orient="index", columns=["Start", "End"])
+
+
+
+
+def strong_tail(cluster, cl, ln, data, read_pos=None):
     """
     Determines whether a cluster has strong coverage at both the start and end of a segment.
     This function checks the reads associated with a cluster to determine if there is strong coverage
@@ -143,22 +162,14 @@ def strong_tail(cluster, cl, ln, data):
     Returns:Tuple[bool, bool]: A tuple with two boolean values:
             - The first value is `True` if the cluster has strong coverage at the start of the segment.
             - The second value is `True` if the cluster has strong coverage at the end of the segment.
+    `read_pos` (see `read_positions`) can be passed if it was already built for the reads of `cl`.
     """
-    count_start = None
-    count_stop = None
-    res = [False,False]
-    reads = list(cl.loc[cl["Cluster"] == cluster, "ReadName"])
-    for read in reads:
-        if data[read]["Start"] < start_end_gap:
-            if count_start == None:
-                count_start = 0
-            count_start = count_start+1
-        if data[read]["End"] > ln - start_end_gap:
-            if count_stop == None:
-                count_stop = 0
-            count_stop = count_stop + 1
-    if count_start!= None and count_start > strong_cluster_min_reads :
-        res[0] = True
-    if  count_stop!= None and count_stop > strong_cluster_min_reads:
-        res[1] = True
+    reads = cl.loc[cl["Cluster"] == cluster, "ReadName"]
+    if read_pos is None:
+        read_pos = read_positions(data, reads)
+    positions = read_pos.loc[reads]
+    starts = positions["Start"].to_numpy()
+    ends = positions["End"].to_numpy()
+    res = [bool(np.count_nonzero(starts < start_end_gap) > strong_cluster_min_reads),
+           bool(np.count_nonzero(ends > ln - start_end_gap) > strong_cluster_min_reads)]
     return res
\ No newline at end of file
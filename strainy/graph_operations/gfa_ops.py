@@ -1,5 +1,6 @@
 import gfapy
 import networkx as nx
+import numpy as np
 import logging
 import pysam
 import re
@@ -52,8 +53,8 @@ def add_edge(graph, name, cov, seq):
     Returns:
         gfa line
     """
-    graph.add_line("S\t%s\t*" % name)
-    new_line = graph.try_get_segment(name)
+    new_line = gfapy.Line("S\t%s\t*" % name)
+    graph.add_line(new_line)
     new_line.name = name
     new_line.sid = name
     new_line.dp = cov
@@ -72,10 +73,8 @@ def gfa_to_nx(g):
         graph (nx): nx graph
     """
     G = nx.Graph()
-    for i in g.segment_names:
-        G.add_node(i)
-    for i in g.dovetails:
-        G.add_edge(i.from_segment.name, i.to_segment.name)
+    G.add_nodes_from(g.segment_names)
+    G.add_edges_from((i.from_name, i.to_name) for i in g.dovetails)
     return G
 
 
@@ -98,9 +97,12 @@ def fa_to_gfa(fasta_file):
 
 def from_pandas_adjacency_notinplace(df, create_using=None):
     """
-    This function is exactly the same as networkx.from_pandas_adjacency,
-    with the exception of 'copy=True' argument in relabel_nodes.
-    This is because copy=False (default option) implies that the graph
+    Builds a graph from a pandas adjacency matrix, with the same nodes, edges and weights
+    as networkx.from_pandas_adjacency.
+    If create_using is nx.DiGraph (the directed cluster graphs), the graph is built
+    directly from the nonzero entries of the matrix, labeled by the column names, without relabeling.
+    Otherwise it falls back to networkx.from_numpy_array followed by relabel_nodes with 'copy=True'.
+    This is because copy=False (default option of from_pandas_adjacency) implies that the graph
     can be relabeled in place, which is not always possible
     https://github.com/networkx/networkx/issues/7407
     """
@@ -112,6 +114,17 @@ def from_pandas_adjacency_notinplace(df, create_using=None):
         raise nx.NetworkXError("Columns must match Indices.", msg) from err
 
     A = df.values
+    if create_using is nx.DiGraph:
+        # build the labeled graph directly from the nonzero entries, avoiding the relabeling copy.
+        # gives the same nodes, edges and weights as from_numpy_array
+        labels = list(df.columns)
+        G = nx.DiGraph()
+        G.add_nodes_from(labels)
+        rows, cols = np.nonzero(A)
+        G.add_edges_from((labels[u], labels[v], {"weight": A[u, v].item()})
+                         for u, v in zip(rows.tolist(), cols.tolist()))
+        return G
+
     G = nx.from_numpy_array(A, create_using=create_using)
 
     G = nx.relabel.relabel_nodes(G, dict(enumerate(df.columns)), copy=True)
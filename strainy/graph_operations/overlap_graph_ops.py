@@ -2,7 +2,6 @@ import networkx as nx
 import pygraphviz as gv
 from collections import Counter, deque, defaultdict
 import logging
-from strainy.graph_operations import gfa_ops
 from strainy.graph_operations import asm_graph_ops
 from strainy.params import *
 
@@ -23,12 +22,11 @@ This contains functions for operation with overlap graph:
 
 
 
-def build_overlap_graph(cons, full_paths_roots, full_paths_leafs, cluster_distances):
+def build_overlap_graph(cons, full_paths_roots, full_paths_leafs, G):
     """
-    Create an "overlap" graph for clusters within a unitig, based on flye distance
+    Create an "overlap" graph for clusters within a unitig, based on flye distance.
+    G is the directed graph of cluster distances, it is modified in place
     """
-    M = cluster_distances
-    G = gfa_ops.from_pandas_adjacency_notinplace(M, create_using = nx.DiGraph)
     G.remove_edges_from(list(nx.selfloop_edges(G)))
     G = remove_nested(G, cons)
     try:
@@ -52,16 +50,24 @@ def find_full_paths(G, paths_roots, paths_leafs):
               as a list of nodes (clusters) in the path.
     """
     paths = []
+    leafs = [leaf for leaf in paths_leafs if leaf in G]
+
+    # only clusters from which a leaf is reachable can be part of a full path,
+    # the search is restricted to them (preserving the adjacency order of G)
+    useful = set(leafs)
+    for leaf in leafs:
+        useful.update(nx.ancestors(G, leaf))
+    G_useful = nx.DiGraph()
+    G_useful.add_nodes_from(n for n in G if n in useful)
+    G_useful.add_edges_from((u, v) for u, v in G.edges() if u in useful and v in useful)
+
     for root in paths_roots:
-        try:
-            #TODO: we need to increase cutoff for longer unitigs with more clusters.
-            #But this will result in the exponential number of paths. Instead, we should be
-            #looking at all nodes that are reachable from both source and sink, which is linear
-            paths_nx = nx.algorithms.all_simple_paths(G, root, paths_leafs, cutoff = 10)
-        except:
-            pass
-        for path in list(paths_nx):
-            paths.append(path)
+        if root not in G_useful:
+            continue
+        #TODO: we need to increase cutoff for longer unitigs with more clusters.
+        #But this will result in the exponential number of paths. Instead, we should be
+        #looking at all nodes that are reachable from both source and sink, which is linear
+        paths.extend(nx.algorithms.all_simple_paths(G_useful, root, leafs, cutoff = 10))
     return paths
 
 
@@ -77,11 +83,14 @@ def remove_transitive(G):
     """
     path_remove = []
     for node in G.nodes():
-        neighbors = nx.all_neighbors(G, node)
-        for neighbor in list(neighbors):
-            for n_path in nx.algorithms.all_simple_paths(G, node, neighbor, cutoff = 3):
-                if len(n_path) == 3:
-                    path_remove.append(n_path)
+        neighbors = set(nx.all_neighbors(G, node))
+        # simple paths of length 2 from node to one of its neighbors: node -> mid -> neighbor
+        for mid in G.successors(node):
+            if mid == node:
+                continue
+            for neighbor in G.successors(mid):
+                if neighbor in neighbors and neighbor != node and neighbor != mid:
+                    path_remove.append([node, mid, neighbor])
     for n_path in path_remove:
          try:
              G.remove_edge(n_path[0], n_path[1])
@@ -101,21 +110,15 @@ def remove_nested(G, cons):
     clusters are removed to avoid redundancy.
     Returns:nx.Graph: The updated graph with nested clusters disconnected from their parent clusters.
     """
-    nodes = list(G.nodes())
-    for node in nodes:
-        try:
-            neighbors = nx.all_neighbors(G, node)
-            for neighbor in list(neighbors):
-                if cons[node]["Start"] < cons[neighbor]["Start"] and cons[node]["End"] > cons[neighbor]["End"]:
-                    try:
-                        G.remove_edge(node, neighbor)
-                        G.remove_edge(neighbor,node)
-                        logger.debug("REMOVE NESTED" + str(neighbor))
-
-                    except:
-                        continue
-        except:
-            continue
+    # nesting is strict, so a pair can only be found once, from the edge leaving the parent cluster
+    edges_remove = []
+    for node, neighbor in G.edges():
+        if cons[node]["Start"] < cons[neighbor]["Start"] and cons[node]["End"] > cons[neighbor]["End"]:
+            edges_remove.append((node, neighbor))
+            if G.has_edge(neighbor, node):
+                edges_remove.append((neighbor, node))
+            logger.debug("REMOVE NESTED" + str(neighbor))
+    G.remove_edges_from(edges_remove)
     return G
 
 
@@ -136,17 +139,13 @@ def remove_leaf_root_subnodes(G,full_paths_roots,full_paths_leafs):
     """
     node_remove = []
     for node in full_paths_leafs:
-        neighbors = list(full_paths_leafs)
-        for neighbor in list(neighbors):
-            for n_path in nx.algorithms.all_simple_paths(G, node, neighbor, cutoff=2):
-                if len(n_path) == 2:
-                    node_remove.append(neighbor)
+        for neighbor in full_paths_leafs:
+            if node != neighbor and G.has_edge(node, neighbor):
+                node_remove.append(neighbor)
     for node in full_paths_roots:
-         neighbors = list(full_paths_roots)
-         for neighbor in list(neighbors):
-             for n_path in nx.algorithms.all_simple_paths(G,  neighbor,node, cutoff = 2):
-                 if len(n_path) == 2:
-                     node_remove.append(neighbor)
+        for neighbor in full_paths_roots:
+            if node != neighbor and G.has_edge(neighbor, node):
+                node_remove.append(neighbor)
     for node in node_remove:
          try:
             G.remove_node(node)
@@ -211,6 +210,9 @@ def boundaries(path_cl, ln, full_paths, paths_roots, paths_leafs, cons):
     for i in order_by_stop_pos:
         cut_l[i] = cut_l_unsorted[i]
         cut_r[i] = cut_r_unsorted[i]
+    # position of each cluster within each path, replaces repeated path.index() scans
+    path_pos = [(path, {member: i for i, member in enumerate(path)}) for path in full_paths]
+
     Members=list(cut_l.keys())
     while Members:
         member=Members.pop(0)
@@ -220,39 +222,40 @@ def boundaries(path_cl, ln, full_paths, paths_roots, paths_leafs, cons):
             Members.insert(0,member_to_q)
         if cut_l[member] != None and (cut_r[member] == None or member in paths_leafs):
             Q = deque()
-            L = []
-            R = []
-            for path in full_paths:
-                try:
-                    L.append(path[path.index(member) + 1])
-                    Q.append(path[path.index(member) + 1])
-                except (ValueError, IndexError):
-                    continue
-            visited = []
-            Q = list(set(Q))
+            L = set()
+            R = set()
+            for path, pos in path_pos:
+                i = pos.get(member)
+                if i is not None and i + 1 < len(path):
+                    L.add(path[i + 1])
+                    Q.append(path[i + 1])
+            visited = set()
+            Q = deque(set(Q))
+            queued = set(Q)     # mirrors the contents of Q for membership tests
             while Q:
                 n = Q.pop()
-                visited.append(n)
+                queued.discard(n)
+                visited.add(n)
                 if n in L:
-                    for path in full_paths:
-                        try:
-                            if path.index(n) > 0:
-                                if path[path.index(n) - 1] not in visited:
-                                    R.append(path[path.index(n) - 1])
-                                    if path[path.index(n) - 1] not in Q:
-                                        Q.append(path[path.index(n) - 1])
-                        except (ValueError, IndexError):
-                            continue
+                    for path, pos in path_pos:
+                        i = pos.get(n)
+                        if i is not None and i > 0:
+                            prev = path[i - 1]
+                            if prev not in visited:
+                                R.add(prev)
+                                if prev not in queued:
+                                    Q.append(prev)
+                                    queued.add(prev)
                 else:
-                    for path in full_paths:
-                        try:
-                            if path[path.index(n) + 1] not in visited:
-                                L.append(path[path.index(n) + 1])
-                                if path[path.index(n) + 1] not in Q:
-                                    Q.append(path[path.index(n) + 1])
-
-                        except (ValueError, IndexError):
-                            continue
+                    for path, pos in path_pos:
+                        i = pos.get(n)
+                        if i is not None and i + 1 < len(path):
+                            nxt = path[i + 1]
+                            if nxt not in visited:
+                                L.add(nxt)
+                                if nxt not in queued:
+                                    Q.append(nxt)
+                                    queued.add(nxt)
             l_borders = []
             r_borders = []
             for i in L:
@@ -269,20 +272,19 @@ def boundaries(path_cl, ln, full_paths, paths_roots, paths_leafs, cons):
             for i in R:
                 cut_r[i] = border
         elif cut_r[member] != None:
-            for path in full_paths:
-                try:
-                    cut_l[path[path.index(member)+1]] = cut_r[member]
-                except:
-                    pass
+            for path, pos in path_pos:
+                i = pos.get(member)
+                if i is not None and i + 1 < len(path):
+                    cut_l[path[i + 1]] = cut_r[member]
 
     if None in cut_l.values():
         for member in cut_l.keys():
             if cut_l[member] == None:
-                for path in full_paths:
-                    try:
-                        cut_l[member] = cut_r[path[path.index(member)-1]]
-                    except:
-                        pass
+                for path, pos in path_pos:
+                    i = pos.get(member)
+                    # note that path[i - 1] wraps around to the last cluster for i == 0
+                    if i is not None and path[i - 1] in cut_r:
+                        cut_l[member] = cut_r[path[i - 1]]
     return cut_l,cut_r
 
 
@@ -292,34 +294,26 @@ def add_path_edges(edge, g, cl, ln, full_paths, G, paths_roots, paths_leafs, ful
     """
     Add gfa nodes (unitigs) forming "full path"
     """
-    path_cl = []
     logger.debug("Add path")
     for node in full_clusters:
-        try:
+        if node in paths_roots:
             paths_roots.remove(node)
-            paths_leafs.remove(node)
-        except:
-            pass
-
-    for path in full_paths.copy():
-        for member in path:
-            if member in full_clusters:
-                try:
-                    full_paths.remove(path)
-                except (ValueError):
-                    pass
-            if member in paths_leafs and path.index(member)!= len(path)-1:
-                try:
-                    full_paths.remove(path)
-                except (ValueError):
-                    pass
-
-    for path in full_paths:
-        for member in path:
-            path_cl.append(member)
+            if node in paths_leafs:
+                paths_leafs.remove(node)
+
+    # drop paths going through a full cluster or through a leaf that is not their last member
+    # full_paths is shared with the add_path_links operation, so it is updated in place
+    full_set = set(full_clusters)
+    leafs_set = set(paths_leafs)
+    full_paths[:] = [path for path in full_paths
+                     if not any(member in full_set or (member in leafs_set and member != path[-1])
+                                for member in path)]
+
+    # clusters of all paths, each once and in path order
+    path_cl = list(dict.fromkeys(member for path in full_paths for member in path))
     cut_l, cut_r=boundaries(path_cl,ln, full_paths, paths_roots, paths_leafs, cons)
 
-    for path_cluster in set(path_cl):
+    for path_cluster in path_cl:
         if cut_l[path_cluster]!= cut_r[path_cluster]:
             asm_graph_ops.add_child_edge(edge, path_cluster, g,  cl, cut_l[path_cluster], cut_r[path_cluster], cons, flye_consensus)
         else:
@@ -335,13 +329,11 @@ def add_path_edges(edge, g, cl, ln, full_paths, G, paths_roots, paths_leafs, ful
 
 
 def paths_graph_add_vis(edge, cons, cl, full_paths_roots,
-                        full_paths_leafs, full_clusters, cluster_distances):
+                        full_paths_leafs, full_clusters, G_vis):
     """
      Graph visualization function
+     G_vis is the directed graph of cluster distances, it is modified in place
     """
-    G_vis = gfa_ops.from_pandas_adjacency_notinplace(cluster_distances,
-                                                     create_using = nx.DiGraph)
-    G_vis.remove_edges_from(list(nx.selfloop_edges(G_vis)))
     G_vis.remove_edges_from(list(nx.selfloop_edges(G_vis)))
 
     try:
@@ -349,10 +341,8 @@ def paths_graph_add_vis(edge, cons, cl, full_paths_roots,
     except:
         pass
 
-    cluster_colors = {}
-    for i, row in cl.iterrows():
-        if row["Cluster"] not in cluster_colors:
-            cluster_colors[row["Cluster"]] = row["Color"]
+    first_rows = cl.drop_duplicates("Cluster")
+    cluster_colors = dict(zip(first_rows["Cluster"], first_rows["Color"]))
 
     for e in G_vis.edges():
         first_cl, second_cl = e
@@ -1,5 +1,9 @@
+import glob
 import os
 import logging
+import shutil
+import tempfile
+import threading
 
 logger = logging.getLogger()
 
@@ -8,7 +12,9 @@ def set_thread_logging(log_dir, log_prefix, thread_id):
     """
     Turns on logging, sets debug levels and assigns a log file
     """
-    #clear all handlers if we rerun this in a new thread
+    #clear all handlers if we rerun this in a new thread, closing them so that log files are not leaked
+    for handler in logger.handlers:
+        handler.close()
     logger.handlers.clear()
     #thread_id = str(multiprocessing.current_process().name).split("-")[-1]
     #thread_id = str(multiprocessing.current_process().pid)
@@ -35,8 +41,24 @@ def set_thread_logging(log_dir, log_prefix, thread_id):
     logger.addHandler(file_handler)
 
 
+def reset_log_dir(log_dir):
+    """
+    Creates an empty log directory. Logs of a previous run (and leftovers of interrupted cleanups)
+    are moved aside and deleted in a background thread, which is returned (None if there was nothing to delete).
+    The thread must be joined before any process is forked
+    """
+    parent_dir = os.path.dirname(os.path.abspath(log_dir))
+    trash_prefix = ".old_" + os.path.basename(log_dir) + "_"
+    old_dirs = glob.glob(os.path.join(parent_dir, glob.escape(trash_prefix) + "*"))
+    if os.path.isdir(log_dir):
+        old_dirs.append(log_dir)
 
-
-
-
-
+    cleanup = None
+    if old_dirs:
+        trash_dir = tempfile.mkdtemp(prefix=trash_prefix, dir=parent_dir)
+        for i, old_dir in enumerate(old_dirs):
+            os.rename(old_dir, os.path.join(trash_dir, str(i)))
+        cleanup = threading.Thread(target=shutil.rmtree, args=(trash_dir, True))
+        cleanup.start()
+    os.makedirs(log_dir, exist_ok=True)
+    return cleanup
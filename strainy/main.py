@@ -11,7 +11,7 @@ import shutil
 from strainy.phase import phase_main
 from strainy.transform import transform_main
 from strainy.params import StRainyArgs, init_global_args_storage
-from strainy.logging import set_thread_logging
+from strainy.logging import set_thread_logging, reset_log_dir
 from strainy.preprocessing import preprocess_cmd_args
 from strainy.__version__ import __version__
 from strainy.graph_operations import gfa_ops
@@ -23,11 +23,11 @@ def get_processor_name():
         return platform.processor()
     elif platform.system() == "Darwin":
         os.environ['PATH'] = os.environ['PATH'] + os.pathsep + '/usr/sbin'
-        command ="sysctl -n machdep.cpu.brand_string"
+        command = ["sysctl", "-n", "machdep.cpu.brand_string"]
         return subprocess.check_output(command).strip()
     elif platform.system() == "Linux":
-        command = "cat /proc/cpuinfo"
-        all_info = subprocess.check_output(command, shell=True).decode().strip()
+        with open("/proc/cpuinfo") as f:
+            all_info = f.read().strip()
         for line in all_info.split("\n"):
             if "model name" in line:
                 return re.sub( ".*model name.*:", "", line,1)
@@ -109,12 +109,13 @@ def main():
 
     os.makedirs(StRainyArgs().output, exist_ok=True)
     os.makedirs(StRainyArgs().output_intermediate, exist_ok=True)
-    if os.path.isdir(StRainyArgs().log_phase):
-        shutil.rmtree(StRainyArgs().log_phase)
-    os.makedirs(StRainyArgs().log_phase, exist_ok=True)
+    log_cleanup = reset_log_dir(StRainyArgs().log_phase)
     set_thread_logging(StRainyArgs().log_phase, "phase_root", None)
 
     preprocess_cmd_args(args)
+    # the old logs are deleted while preprocessing, this has to finish before the stages fork workers
+    if log_cleanup is not None:
+        log_cleanup.join()
 
     if StRainyArgs().debug:
         print(f'Using processor(s): {get_processor_name()}')
@@ -124,21 +125,23 @@ def main():
     if args.only_split=='True':
         sys.exit()
     elif args.stage == "phase":
-        sys.exit(phase_main(args))
+        phase_main(args)
+        sys.exit(0)
     elif args.stage == "transform":
         sys.exit(transform_main(args))
     elif args.stage == "e2e":
         import cProfile
         pr_phase = cProfile.Profile()
         pr_phase.enable()
-        phase_main(args)
+        consensus_dict = phase_main(args)
         logger.info("Phase stage completed, starting transform now...")
         pr_phase.disable()
         pr_phase.dump_stats(f'{StRainyArgs().output_intermediate}/phase.prof')
 
         pr_transform = cProfile.Profile()
         pr_transform.enable()
-        transform_main(args)
+        # transform_main empties consensus_dict once the entries are in its own cache
+        transform_main(args, consensus_dict)
         logger.info("Transform stage completed, exiting...")
         pr_transform.disable()
         pr_transform.dump_stats(f'{StRainyArgs().output_intermediate}/transform.prof')
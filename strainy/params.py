@@ -24,6 +24,7 @@ def init_global_args_storage(args):
     _glob_args.log_transform = os.path.join(args.output, "log_transform")
     _glob_args.phased_unitig_info_table_path = os.path.join(args.output, "phased_unitig_info_table.csv")
     _glob_args.reference_unitig_info_table_path = os.path.join(args.output, "reference_unitig_info_table.csv")
+    _glob_args.stats_clusters_path = os.path.join(_glob_args.output_intermediate, "stats_clusters.txt")
     _glob_args.phased_unitig_info_table = {}
     _glob_args.reference_unitig_info_table = {}
     _glob_args.edges = args.graph_edges
@@ -56,6 +57,17 @@ consensus_cache_path = "consensus_dict.pkl"
 write_consensus_cache = True
 delete_flye_files = True
 
+# Optional directory (e.g. a tmpfs such as /dev/shm) for the per-cluster Flye polishing files,
+# set with the STRAINY_TMP environment variable and only used when delete_flye_files is set.
+# By default, and whenever writing there fails, the files go to the flye_inputs intermediate directory
+flye_tmp_dir = os.environ.get("STRAINY_TMP")
+
+# Clusters with fewer reads are not polished, the unitig sequence is used as their consensus
+min_polish_reads = 2
+
+# Debug drawings of larger cluster graphs are skipped, their Graphviz layout takes too long
+max_vis_graph_size = 500
+
 """It is not recommended to change parameters below"""
 
 
@@ -1,3 +1,4 @@
+import glob
 import multiprocessing
 import os
 import pickle
@@ -18,11 +19,26 @@ from strainy.logging import set_thread_logging
 
 logger = logging.getLogger()
 
+# set once per pool worker by _thread_init, so that tasks only carry the edge index
+_worker_flye_consensus = None
+_worker_args = None
+
+
+def _thread_init(shared_flye_consensus, args):
+    global _worker_flye_consensus, _worker_args
+    _worker_flye_consensus = shared_flye_consensus
+    _worker_args = args
+    init_global_args_storage(args)
+    set_thread_logging(StRainyArgs().log_phase, "phase", multiprocessing.current_process().pid)
+
+
+def _thread_task(i):
+    _thread_fun(i, _worker_flye_consensus, _worker_args)
+
 
 def _thread_fun(i, shared_flye_consensus, args):
     init_global_args_storage(args)
 
-    set_thread_logging(StRainyArgs().log_phase, "phase", multiprocessing.current_process().pid)
     logger.info("\n\n\t == == Processing unitig "
                 + str(StRainyArgs().edges_to_phase[i]) + " == == ")
 
@@ -32,6 +48,7 @@ def _thread_fun(i, shared_flye_consensus, args):
         logger.error("Worker thread exception! " + str(excpt) + "\n" + traceback.format_exc())
         raise excpt
 
+    shared_flye_consensus.flush_local_statistics()
     logger.debug("Thread worker function finished!")
 
 
@@ -46,10 +63,16 @@ def phase(edges, args):
         for i in range(len(edges)):
             cluster(i, shared_flye_consensus)
     else:
-        pool = multiprocessing.Pool(StRainyArgs().threads)
-        init_args = [(i, shared_flye_consensus, args) for i in range(len(edges))]
-
-        results = pool.starmap_async(_thread_fun, init_args, chunksize=1)
+        # the pairwise consensus distances of an edge are computed inside a single worker,
+        # so the longest edges (with the most clusters) are dispatched first to avoid
+        # a long tail where one worker is still busy while the others are idle
+        with pysam.AlignmentFile(StRainyArgs().bam, "rb") as bam:
+            edge_lengths = [bam.get_reference_length(edge) for edge in edges]
+        order = sorted(range(len(edges)), key=lambda i: edge_lengths[i], reverse=True)
+
+        pool = multiprocessing.Pool(StRainyArgs().threads, initializer=_thread_init,
+                                    initargs=(shared_flye_consensus, args))
+        results = pool.map_async(_thread_task, order, chunksize=1)
         while not results.ready():
             time.sleep(0.01)
             if not results._success:
@@ -80,27 +103,22 @@ def color_bam(edges, transfrom_stage=False):
         final_aln = os.path.join(StRainyArgs().output, "alignment_phased_merged.bam")
 
 
-    files_to_be_merged = []
-    for fname in subprocess.check_output(f'find {out_bam_dir} -name "*unitig*.bam"',
-                                         shell = True, universal_newlines = True).split("\n"):
-        if len(fname):
-            files_to_be_merged.append(fname)
+    files_to_be_merged = glob.glob(os.path.join(out_bam_dir, "**", "*unitig*.bam"), recursive=True)
 
     # Number of file to be merged could be > 4092,
     # in which case samtools merge throws too many open files error
-    for i, bam_file in enumerate(files_to_be_merged):
-        # fetch the header and put it at the top of the file, for the first bam_file only
-        if i == 0:
-            subprocess.check_output(f'samtools view -H {bam_file} > '
-                                    f'{out_bam_dir}/coloredSAM.sam',shell = True)
+    with open(f'{out_bam_dir}/coloredSAM.sam', "w") as colored_sam:
+        for i, bam_file in enumerate(files_to_be_merged):
+            # fetch the header and put it at the top of the file, for the first bam_file only
+            if i == 0:
+                subprocess.check_call(["samtools", "view", "-H", bam_file], stdout=colored_sam)
 
-        # convert bam to sam, append to the file
-        subprocess.check_output(f'samtools view {bam_file} >> {out_bam_dir}/coloredSAM.sam',
-                                shell = True)
+            # convert bam to sam, append to the file
+            subprocess.check_call(["samtools", "view", bam_file], stdout=colored_sam)
 
     # convert the file to bam and sort
-    subprocess.check_output(f'samtools view -b {out_bam_dir}/coloredSAM.sam >> '
-                            f'{out_bam_dir}/unsortedBAM.bam',shell = True)
+    subprocess.check_call(["samtools", "view", "-b", "-o", f'{out_bam_dir}/unsortedBAM.bam',
+                           f'{out_bam_dir}/coloredSAM.sam'])
     pysam.samtools.sort(f'{out_bam_dir}/unsortedBAM.bam', "-o", final_aln)
     pysam.samtools.index(final_aln)
 
@@ -118,8 +136,7 @@ def phase_main(args):
             "%s/clusters/" % StRainyArgs().output_intermediate,
             "%s/bam/" % StRainyArgs().output_intermediate,
             "%s/bam/clusters" % StRainyArgs().output_intermediate,
-            "%s/flye_inputs" % StRainyArgs().output_intermediate,
-            "%s/flye_outputs" % StRainyArgs().output_intermediate
+            "%s/flye_inputs" % StRainyArgs().output_intermediate
 )
     debug_dirs = ("%s/graphs/" % StRainyArgs().output_intermediate,
                   "%s/adj_M/" % StRainyArgs().output_intermediate
@@ -134,9 +151,10 @@ def phase_main(args):
     consensus_dict = phase(StRainyArgs().edges_to_phase, args)
     if write_consensus_cache:
         with open(os.path.join(StRainyArgs().output_intermediate, consensus_cache_path), "wb") as f:
-            pickle.dump(consensus_dict, f)
+            pickle.dump(consensus_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
     color_bam(StRainyArgs().edges)
     logger.info("Done")
+    return consensus_dict
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ import subprocess
 
 from strainy.params import StRainyArgs
 from strainy.graph_operations import gfa_ops
+from strainy.clustering import build_data
 logger = logging.getLogger()
 
 def create_bam_file(fasta_file, fastq_file, output_file, num_threads, index=True):
@@ -147,11 +148,7 @@ def get_unitigs_to_phase(input_graph, bam_file):
     edges_to_phase = []
     min_unitig_length = 1000 * StRainyArgs().min_unitig_length # convert kb to b
     for unitig in input_graph.segments:
-        alignment_coverage = round(float(pysam.samtools.coverage("-r",
-                                                                 unitig.name,
-                                                                 bam_file,
-                                                                 "--no-header").
-                                                                 split()[6]))
+        alignment_coverage = round(build_data.unitig_coverage(bam_file, unitig.name)[1])
         if (StRainyArgs().min_unitig_coverage <= alignment_coverage <= StRainyArgs().max_unitig_coverage
                 and unitig.length > min_unitig_length):
             edges_to_phase.append(unitig.name)
@@ -8,7 +8,6 @@ import pickle
 import logging
 import multiprocessing
 import shutil
-import pysam
 import time
 import traceback
 import csv
@@ -22,12 +21,13 @@ from strainy.unitig_statistics import utg_stats
 from strainy.flye_consensus import FlyeConsensus
 from strainy.clustering import build_data
 from strainy.params import *
-from strainy.logging import set_thread_logging
+from strainy.logging import set_thread_logging, reset_log_dir
 from strainy.reports.strainy_stats import strain_stats_report
 from strainy.reports.call_variants import produce_strainy_vcf
 from strainy.preprocessing import gfa_to_fasta
 from strainy.phase import color_bam
 from dataclasses import dataclass
+from functools import lru_cache
 logger = logging.getLogger()
 
 
@@ -35,6 +35,23 @@ logger = logging.getLogger()
 
 
 
+# set once per pool worker by _gcu_worker_init, so that tasks only carry the edge name
+_worker_flye_consensus = None
+_worker_args = None
+
+
+def _gcu_worker_init(flye_consensus, args):
+    global _worker_flye_consensus, _worker_args
+    _worker_flye_consensus = flye_consensus
+    _worker_args = args
+    init_global_args_storage(args)
+    set_thread_logging(StRainyArgs().log_transform, "gcu", multiprocessing.current_process().pid)
+
+
+def _gcu_pool_task(edge):
+    return gcu_worker(edge, _worker_flye_consensus, _worker_args)
+
+
 def gcu_worker(edge, flye_consensus, args):
     init_global_args_storage(args)
 
@@ -45,11 +62,10 @@ def gcu_worker(edge, flye_consensus, args):
     graph_ops = []
     remove_clusters = set()
 
-    set_thread_logging(StRainyArgs().log_transform, "gcu", multiprocessing.current_process().pid)
     logger.info("\n\n\t == == Processing unitig " + edge + " == == ")
 
     try:
-        graph_create_unitigs(edge,
+        stats_row = graph_create_unitigs(edge,
                             flye_consensus,
                             bam_cache,
                             link_clusters,
@@ -60,7 +76,8 @@ def gcu_worker(edge, flye_consensus, args):
     except Exception as e:
         logger.error("Worker thread exception! " + str(e) + "\n" + traceback.format_exc())
         raise e
-    return bam_cache, link_clusters, link_clusters_src, link_clusters_sink, graph_ops, remove_clusters
+    flye_consensus.flush_local_statistics()
+    return (bam_cache, link_clusters, link_clusters_src, link_clusters_sink, graph_ops, remove_clusters), stats_row
 
 
 def parallelize_gcu(pool, graph_edges, flye_consensus, graph, args):
@@ -69,6 +86,9 @@ def parallelize_gcu(pool, graph_edges, flye_consensus, graph, args):
     especially when handling a large number of graph edges.
     This function manages multithreading to create new unitigs in parallel, and then merges
     the results to update the graph and handle further graph operations.
+    The pool is expected to be initialized with _gcu_worker_init, so only edge names are sent to the workers.
+    Workers never modify the graph: they return the graph operations, which are applied here one by one,
+    so edges can be processed in any order and in any combination.
     """
     if StRainyArgs().threads == 1:
         result_values = []
@@ -76,8 +96,7 @@ def parallelize_gcu(pool, graph_edges, flye_consensus, graph, args):
             result_values.append(gcu_worker(edge, flye_consensus, args))
 
     else:
-        init_args = [(edge, flye_consensus, args) for edge in graph_edges]
-        results = pool.starmap_async(gcu_worker, init_args, chunksize=1)
+        results = pool.map_async(_gcu_pool_task, graph_edges, chunksize=1)
         while not results.ready():
             time.sleep(0.01)
             if not results._success:
@@ -95,8 +114,10 @@ def parallelize_gcu(pool, graph_edges, flye_consensus, graph, args):
     remove_clusters = []
     
     outputs = [bam_cache, link_clusters, link_clusters_src, link_clusters_sink, graph_ops, remove_clusters]
+    stats_rows = []
     # join the results of multiple threads
-    for r in result_values:
+    for r, stats_row in result_values:
+        stats_rows.append(stats_row)
         for i in range(len(r)):
             if i == len(r) - 1 or i == len(r) - 2:
                 for k in r[i]:
@@ -104,12 +125,21 @@ def parallelize_gcu(pool, graph_edges, flye_consensus, graph, args):
             else:
                 for k, v in r[i].items():
                     outputs[i][k] = v
+
+    # the per-edge statistics are written here at once, so the workers never share the file
+    with open(StRainyArgs().stats_clusters_path, "a") as stats:
+        stats.write("Edge" + "\t" + "Fill Clusters" + "\t" + "Full Paths Clusters" + "\n")
+        stats.writelines(stats_rows)
     
     # operations on the graph performed after the parallel graph_create_unitig
     # this is due to not being able to pass the graph object to threads
+    parent_segments = {}
     for op in graph_ops:
         if op[0] == 'add_child_edge':
-            asm_graph_ops.add_child_edge(op[1], op[2], graph, op[3], op[4], op[5], op[6], flye_consensus, op[7], op[8])
+            if op[1] not in parent_segments:
+                parent_segments[op[1]] = graph.try_get_segment(op[1])
+            asm_graph_ops.add_child_edge(op[1], op[2], graph, op[3], op[4], op[5], op[6], flye_consensus, op[7], op[8], op[9],
+                                         parent_segments[op[1]])
         elif op[0] == 'add_path_edges':
             overlap_graph_ops.add_path_edges(op[1], graph, op[2], op[5], op[6], op[7], op[8], op[9], op[10], op[11], flye_consensus)
         elif op[0] == 'add_path_links':
@@ -123,7 +153,7 @@ def graph_create_unitigs(edge, flye_consensus, bam_cache, link_clusters,
     """
     First stage of the transformation: creation of all new unitigs from clusters obtained during the phasing stage
     Returns:
-    None: The function performs operations in-place, modifying GFA graph
+    str: The line of stats_clusters.txt for this edge. Graph operations are appended to graph_ops
     """
 
     full_paths_roots = []
@@ -131,8 +161,6 @@ def graph_create_unitigs(edge, flye_consensus, bam_cache, link_clusters,
     full_paths = []
     full_clusters = []
 
-    graph = gfapy.Gfa.from_file(StRainyArgs().gfa)
-
     cl = None
     try:
         cl = pd.read_csv("%s/clusters/clusters_%s_%s_%s.csv" % (StRainyArgs().output_intermediate, edge, I, StRainyArgs().AF), keep_default_na = False)
@@ -145,7 +173,7 @@ def graph_create_unitigs(edge, flye_consensus, bam_cache, link_clusters,
         data = build_data.read_bam(StRainyArgs().bam, edge, SNP_pos, min_mapping_quality,min_base_quality,min_al_len, de_max[StRainyArgs().mode])
         bam_cache[edge] = data
 
-        ln = int(pysam.samtools.coverage("-r", edge, StRainyArgs().bam, "--no-header").split()[4])
+        ln = build_data.unitig_coverage(StRainyArgs().bam, edge)[0]
         if len(cl.loc[cl["Cluster"] == 0,"Cluster"].values) > 10:
             cl.loc[cl["Cluster"] == 0, "Cluster"] = 1000000
         clusters = sorted(set(cl.loc[cl["Cluster"] != "NA","Cluster"].values))
@@ -167,46 +195,52 @@ def graph_create_unitigs(edge, flye_consensus, bam_cache, link_clusters,
                     full_paths_leafs.append(cluster)
                 consensus = flye_consensus.flye_consensus(cluster, edge, cl)
                 # add_child_edge(edge, cluster, graph, cl, consensus["start"], consensus["end"], cons, flye_consensus,change_seq = False)
-                graph_ops.append(['add_child_edge', edge, cluster, cl, consensus["start"], consensus["end"], cons, False, True])
+                graph_ops.append(['add_child_edge', edge, cluster, cl, consensus["start"], consensus["end"], cons, False, True, consensus])
             link_clusters[edge] = list(clusters)
             link_clusters_sink[edge] = list(clusters)
             link_clusters_src[edge] = list(clusters)
             remove_clusters.add(edge)
 
         if len(clusters) > 1:
+            # read positions are collected once for all clusters of the edge
+            read_pos = asm_graph_ops.read_positions(data, cl["ReadName"])
             for cluster in clusters:
                 clStart = cons[cluster]["Start"]
                 clStop = cons[cluster]["End"]
+                tail = asm_graph_ops.strong_tail(cluster, cl, ln, data, read_pos)
                 if clStart < start_end_gap and clStop > ln - start_end_gap:
-                    if asm_graph_ops.strong_tail(cluster, cl, ln, data)[0] == True and asm_graph_ops.strong_tail(cluster, cl, ln,data)[1] == True:
+                    if tail[0] == True and tail[1] == True:
                         consensus = flye_consensus.flye_consensus(cluster, edge, cl)
                         # add_child_edge(edge, cluster, graph, cl,consensus["start"], consensus["end"], cons, flye_consensus)
-                        graph_ops.append(['add_child_edge', edge, cluster, cl, consensus["start"], consensus["end"], cons, True, True])
+                        graph_ops.append(['add_child_edge', edge, cluster, cl, consensus["start"], consensus["end"], cons, True, True, consensus])
                         full_clusters.append(cluster)
 
-                    elif asm_graph_ops.strong_tail(cluster, cl, ln, data)[0] != True:
+                    elif tail[0] != True:
                         cons[cluster]["Start"] = cons[cluster]["Start"] + start_end_gap+1
                     else:
                         cons[cluster]["End"] = cons[cluster]["End"] - start_end_gap-1
-                if clStart < start_end_gap and asm_graph_ops.strong_tail(cluster, cl, ln, data)[0] == True :
+                if clStart < start_end_gap and tail[0] == True :
                     full_paths_roots.append(cluster)
-                if clStop > ln - start_end_gap and asm_graph_ops.strong_tail(cluster, cl, ln, data)[1] == True:
+                if clStop > ln - start_end_gap and tail[1] == True:
                     full_paths_leafs.append(cluster)
 
             cluster_distances = postprocess.build_adj_matrix_clusters(edge, cons, cl, flye_consensus, False)
             cluster_distances = matrix.change_w(cluster_distances,0)
 
-            G = overlap_graph_ops.build_overlap_graph(cons, full_paths_roots, full_paths_leafs, cluster_distances.copy())
+            # the distance graph is built once and copied for each of its uses below
+            cluster_graph = gfa_ops.from_pandas_adjacency_notinplace(cluster_distances, create_using = nx.DiGraph)
+            G = overlap_graph_ops.build_overlap_graph(cons, full_paths_roots, full_paths_leafs, cluster_graph.copy())
 
             #full_cl[edge] = full_clusters
-            if StRainyArgs().debug:
+            if StRainyArgs().debug and \
+                    max(cluster_graph.number_of_nodes(), cluster_graph.number_of_edges()) < max_vis_graph_size:
                 overlap_graph_ops.paths_graph_add_vis(edge,
                                     cons,
                                     cl,
                                     full_paths_roots,
                                     full_paths_leafs,
                                     full_clusters,
-                                    cluster_distances.copy())
+                                    cluster_graph.copy())
 
             try:
                 full_paths = overlap_graph_ops.find_full_paths(G,full_paths_roots, full_paths_leafs)
@@ -217,35 +251,35 @@ def graph_create_unitigs(edge, flye_consensus, bam_cache, link_clusters,
                            full_paths_leafs,full_clusters,cons])
             graph_ops.append(['add_path_links', edge, full_paths])
 
-            othercl = list(set(clusters) - set(full_clusters) - {j for i in full_paths for j in i})
+            path_clusters = {j for i in full_paths for j in i}
+            othercl = list(set(clusters) - set(full_clusters) - path_clusters)
             if len(othercl) > 0:
-                G = gfa_ops.from_pandas_adjacency_notinplace(cluster_distances.copy(), create_using = nx.DiGraph)
+                G = cluster_graph
 
             close_to_full = []
             othercl_len=[cons[i]['End']-cons[i]['Start'] for i in othercl]
             othercl_sorted=[i[1] for i  in sorted(zip(othercl_len, othercl), reverse=True)]
-            removed=[]
+            full_clusters_set = set(full_clusters)
+            remaining = set(othercl)
+            removed = set()
             for cluster in othercl_sorted:
-                neighbors = nx.all_neighbors(G, cluster)
-                A = set(neighbors)
-                B = {j for i in full_paths for j in i}
-                if len(A.intersection(set(full_clusters))) > 0 or len(A.intersection(B)) > 0: #remove close-to full to avoid duplication
-                    try:
-                        othercl.remove(cluster)
+                A = set(nx.all_neighbors(G, cluster))
+                if A & full_clusters_set or A & path_clusters: #remove close-to full to avoid duplication
+                    if cluster in remaining:
+                        remaining.discard(cluster)
                         close_to_full.append(cluster)
-                        removed.append(cluster)
-                    except (ValueError):
-                        pass
+                        removed.add(cluster)
                 if len(A)>0 and cluster not in removed: #leave longest and remove their neighbors
                     for i in A:
-                        try:
-                            othercl.remove(i)
-                            removed.append(i)
+                        if i in remaining:
+                            remaining.discard(i)
+                            removed.add(i)
                             logger.debug("REMOVE " + str(cluster))
-                        except (ValueError):
-                            pass
+            othercl = [i for i in othercl if i in remaining]
 
 
+            # the assembly graph is only needed here, it is not parsed for unitigs with fewer clusters
+            graph = gfapy.Gfa.from_file(StRainyArgs().gfa)
             updated_edge=asm_graph_ops.change_cov(graph, edge, cons, ln, clusters, othercl, remove_clusters)
             updated_cov=updated_edge.dp
             if  updated_cov < parental_min_coverage and len(clusters) - len(othercl) != 0 and (len(set(full_clusters))>0 or len(full_paths)>0):
@@ -253,18 +287,17 @@ def graph_create_unitigs(edge, flye_consensus, bam_cache, link_clusters,
             else:
                 for cluster in othercl:
                     consensus = flye_consensus.flye_consensus(cluster, edge, cl)
-                    graph_ops.append(['add_child_edge', edge, cluster, cl, cons[cluster]["Start"], cons[cluster]["End"], cons, True, False])
+                    graph_ops.append(['add_child_edge', edge, cluster, cl, cons[cluster]["Start"], cons[cluster]["End"], cons, True, False, consensus])
                 remove_clusters.add(edge)
 
             link_clusters[edge] = list(full_clusters) + list(
-                set(full_paths_roots).intersection({j for i in full_paths for j in i})) + list(
-                set(full_paths_leafs).intersection({j for i in full_paths for j in i}))
+                set(full_paths_roots).intersection(path_clusters)) + list(
+                set(full_paths_leafs).intersection(path_clusters))
             link_clusters_src[edge] = list(full_clusters) + list(
-                set(full_paths_roots).intersection({j for i in full_paths for j in i}))
+                set(full_paths_roots).intersection(path_clusters))
             link_clusters_sink[edge] = list(full_clusters) + list(
-                set(full_paths_leafs).intersection({j for i in full_paths for j in i}))
+                set(full_paths_leafs).intersection(path_clusters))
 
-    stats = open("%s/stats_clusters.txt" % StRainyArgs().output_intermediate, "a")
     fcN = 0
     fpN = 0
 
@@ -280,8 +313,17 @@ def graph_create_unitigs(edge, flye_consensus, bam_cache, link_clusters,
 
     logger.info("%s: %s unitigs are created" % (edge,str(fcN+fpN)))
     othercl = len(clusters)-fcN-fpN
-    stats.write(edge + "\t" + str(fcN) + "\t" + str(fpN) + "\t" + str(othercl) +"\n")
-    stats.close()
+    return edge + "\t" + str(fcN) + "\t" + str(fpN) + "\t" + str(othercl) +"\n"
+
+
+@lru_cache(maxsize=256)
+def _read_clusters(edge):
+    """
+    Reads the read names and cluster ids of the phased unitig.
+    Cached, as a unitig is read again for each of its linked neighbours
+    """
+    return pd.read_csv("%s/clusters/clusters_%s_%s_%s.csv" % (StRainyArgs().output_intermediate, edge, I, StRainyArgs().AF),
+                       keep_default_na = False, usecols = ["ReadName", "Cluster"], dtype = {"ReadName": str})
 
 
 def graph_link_unitigs(edge, graph, nx_graph,  bam_cache, link_clusters, link_clusters_src,
@@ -298,11 +340,10 @@ def graph_link_unitigs(edge, graph, nx_graph,  bam_cache, link_clusters, link_cl
     link_added = False
 
     clusters = link_clusters[edge]
+    # unitigs without phased clusters have nothing to link
+    if not clusters:
+        return
 
-    try:
-        cl = pd.read_csv("%s/clusters/clusters_%s_%s_%s.csv" % (StRainyArgs().output_intermediate, edge, I, StRainyArgs().AF), keep_default_na = False)
-    except(FileNotFoundError):
-        pass
     link_unitigs = []
 
     for phase_clust in set(clusters):
@@ -312,9 +353,26 @@ def graph_link_unitigs(edge, graph, nx_graph,  bam_cache, link_clusters, link_cl
         except:
             continue
 
+    if not link_unitigs:
+        return
+
+    try:
+        cl = _read_clusters(edge)
+    except(FileNotFoundError):
+        pass
+
+    reads_by_cluster = cl.groupby("Cluster", sort=False)["ReadName"].agg(list).to_dict()
+    # unitigs within max_hops nodes (including both ends) of the current one, found with a single BFS
+    if edge in nx_graph:
+        close_segments = nx.single_source_shortest_path_length(nx_graph, edge, cutoff=max_hops - 1)
+    else:
+        close_segments = {}
+    # read -> cluster mapping of the neighbouring unitigs, None if the unitig has no clusters
+    neighbour_clusters = {}
+
     #for each cluster in the initial unitig
     for cur_clust in link_unitigs:
-        cluster_reads = list(cl.loc[cl["Cluster"] == cur_clust, "ReadName"])
+        cluster_reads = reads_by_cluster.get(cur_clust, [])
         neighbours = {}
         orient = {}
 
@@ -322,11 +380,8 @@ def graph_link_unitigs(edge, graph, nx_graph,  bam_cache, link_clusters, link_cl
         read_data = bam_cache[edge]
         for read in cluster_reads:
             for next_seg, link_orientation in read_data[read]["Rclip"]:
-                try:
-                    if len(nx.shortest_path(nx_graph, next_seg, edge)) <= max_hops:
-                        neighbours[read] = next_seg
-                except (nx.NetworkXNoPath, nx.NodeNotFound):
-                    pass
+                if next_seg in close_segments:
+                    neighbours[read] = next_seg
 
                 if link_orientation == "+":
                     orient[next_seg] = ("+", "+")
@@ -334,11 +389,8 @@ def graph_link_unitigs(edge, graph, nx_graph,  bam_cache, link_clusters, link_cl
                     orient[next_seg] = ("+", "-")
 
             for next_seg, link_orientation in read_data[read]["Lclip"]:
-                try:
-                    if len(nx.shortest_path(nx_graph, next_seg, edge)) <= max_hops:
-                        neighbours[read] = next_seg
-                except (nx.NetworkXNoPath, nx.NodeNotFound):
-                    pass
+                if next_seg in close_segments:
+                    neighbours[read] = next_seg
 
                 if link_orientation == "+":
                     orient[next_seg] = ("-", "-")
@@ -349,10 +401,14 @@ def graph_link_unitigs(edge, graph, nx_graph,  bam_cache, link_clusters, link_cl
         for next_seg in set({k for k, v in Counter(neighbours.values()).items() if v >= min_reads_neighbour}):
             #print(f"\tPROCESSING outgoing segment {next_seg}")
             fr_or, to_or = orient[next_seg]
-            try:
-                cl_n = pd.read_csv("%s/clusters/clusters_%s_%s_%s.csv" % (StRainyArgs().output_intermediate, next_seg,
-                                                                          I, StRainyArgs().AF), keep_default_na = False)
-            except(FileNotFoundError):
+            if next_seg not in neighbour_clusters:
+                try:
+                    cl_n = _read_clusters(next_seg)
+                    neighbour_clusters[next_seg] = dict(zip(cl_n["ReadName"], cl_n["Cluster"]))
+                except(FileNotFoundError):
+                    neighbour_clusters[next_seg] = None
+            read_to_cluster = neighbour_clusters[next_seg]
+            if read_to_cluster is None:
                 gfa_ops.add_link(graph, f"{edge}_{cur_clust}", fr_or, next_seg, to_or, 555)
                 continue
 
@@ -361,14 +417,14 @@ def graph_link_unitigs(edge, graph, nx_graph,  bam_cache, link_clusters, link_cl
             for read, read_adj in neighbours.items():
                 if read_adj == next_seg:
                     connecting_reads.append(read)
-            connected_clusters = cl_n.loc[cl_n["ReadName"].isin(connecting_reads), "Cluster"]
-            connected_clusters_thld = list({x for x in list(Counter(list(connected_clusters)))
-                                            if Counter(list(connected_clusters))[x]  >= min_reads_cluster})
+            connected_clusters = [read_to_cluster[read] for read in connecting_reads if read in read_to_cluster]
+            connected_counts = Counter(connected_clusters)
+            connected_clusters_thld = [x for x, count in connected_counts.items() if count >= min_reads_cluster]
 
             #make cluster-cluster connections
             link_added = False
             for next_clust in connected_clusters_thld:
-                w = Counter(list(connected_clusters))[next_clust]
+                w = connected_counts[next_clust]
                 try:
                     if graph.try_get_segment(f"{next_seg}_{next_clust}"):
                         gfa_ops.add_link(graph, f"{edge}_{cur_clust}", fr_or, f"{next_seg}_{next_clust}", to_or, w)
@@ -461,18 +517,19 @@ def connect_parental_edges(graph, link_clusters_src, link_clusters_sink, remove_
 
 
 
-def transform_main(args):
+def transform_main(args, consensus_dict=None):
+    """
+    Second stage of the pipeline: builds the phased graph from the clusters of the phase stage.
+    consensus_dict can be passed when the phase stage ran in the same process,
+    otherwise the consensus cache written by the phase stage is loaded from disk.
+    A passed consensus_dict is emptied once its entries are copied to the FlyeConsensus cache.
+    """
     init_global_args_storage(args)
 
-    if os.path.isdir(StRainyArgs().log_transform):
-        shutil.rmtree(StRainyArgs().log_transform)
-    os.mkdir(StRainyArgs().log_transform)
+    edges = StRainyArgs().edges
+    log_cleanup = reset_log_dir(StRainyArgs().log_transform)
     set_thread_logging(StRainyArgs().log_transform, "transform_root", None)
 
-    stats = open("%s/stats_clusters.txt" % StRainyArgs().output_intermediate, "a")
-    stats.write("Edge" + "\t" + "Fill Clusters" + "\t" + "Full Paths Clusters" + "\n")
-    stats.close()
-
     """
     Here we put a hard limit on the number of 16 threads. This is because of an issue in CPython implementation
     of multiprocessing that has a hardcoded contant of max 16 threads that can wait for Lock().
@@ -483,34 +540,41 @@ def transform_main(args):
     """
     HARD_LIMIT = 16
     num_threads = min(StRainyArgs().threads, HARD_LIMIT)
-    pool = None
-    if StRainyArgs().threads != 1:
-        pool = multiprocessing.Pool(num_threads)
+    # the old logs have to be deleted before the manager and pool processes are forked
+    if log_cleanup is not None:
+        log_cleanup.join()
     default_manager = multiprocessing.Manager()
 
     initial_graph = gfapy.Gfa.from_file(StRainyArgs().gfa)
     #Setting up coverage for all unitigs based on bam alignment depth
     logger.info("Re-setting unitigs coverage")
     ref_coverage = {}
-    for edge in StRainyArgs().edges:
-        edge_cov = pysam.samtools.coverage("-r", edge, StRainyArgs().bam, "--no-header").split()[6]
+    for edge in edges:
+        edge_cov = build_data.unitig_coverage(StRainyArgs().bam, edge)[1]
         initial_graph.try_get_segment(edge).dp = round(float(edge_cov))
         ref_coverage[edge] = round(float(edge_cov))
 
-    logger.info("Loading phased unitigs dictionary")
-    try:
-        with open(os.path.join(StRainyArgs().output_intermediate, consensus_cache_path), "rb") as f:
-            logger.debug(f"searching consensus cache in {os.getcwd()}")
-            consensus_dict = pickle.load(f)
-    except FileNotFoundError:
-        consensus_dict = {}
+    if consensus_dict is None:
+        logger.info("Loading phased unitigs dictionary")
+        try:
+            with open(os.path.join(StRainyArgs().output_intermediate, consensus_cache_path), "rb") as f:
+                logger.debug(f"searching consensus cache in {os.getcwd()}")
+                consensus_dict = pickle.load(f)
+        except FileNotFoundError:
+            consensus_dict = {}
 
     flye_consensus = FlyeConsensus(StRainyArgs().bam, StRainyArgs().fa, args.threads, consensus_dict, default_manager)
-    consensus_dict = {}
+    # the entries now live in the manager, the caller's reference must not keep a second copy alive
+    consensus_dict.clear()
+
+    # the pool is started once flye_consensus exists, so that it is handed to each worker only once
+    pool = None
+    if StRainyArgs().threads != 1:
+        pool = multiprocessing.Pool(num_threads, initializer=_gcu_worker_init, initargs=(flye_consensus, args))
 
     logger.info("### Create unitigs")
     bam_cache, link_clusters, link_clusters_src, link_clusters_sink, remove_clusters, initial_graph = \
-            parallelize_gcu(pool, StRainyArgs().edges, flye_consensus, initial_graph, args)
+            parallelize_gcu(pool, edges, flye_consensus, initial_graph, args)
 
     # Save phased and reference unitigs' info as a csv
     logger.info('Creating csv file with phased unitigs...')
@@ -521,20 +585,23 @@ def transform_main(args):
 
 
     logger.info("### Link unitigs")
+    # linking can only start once all unitigs are created: an edge is linked to the unitigs of its
+    # neighbours, and uses their link_clusters and remove_clusters entries
     nx_graph = gfa_ops.gfa_to_nx(initial_graph)
-    for edge in StRainyArgs().edges:
+    for edge in edges:
         graph_link_unitigs(edge, initial_graph, nx_graph, bam_cache, link_clusters, link_clusters_src,
                            link_clusters_sink, remove_clusters)
     connect_parental_edges(initial_graph, link_clusters_src, link_clusters_sink, remove_clusters)
 
     logger.info("### Remove initial segments")
-    for ed in initial_graph.segments:
-        if ed.name in remove_clusters:
-            logger.debug(f"Removing {ed.name}")
-            initial_graph.rm(ed)
-    for link in initial_graph.dovetails:
-        if link.to_segment in remove_clusters or link.from_segment in remove_clusters:
-            initial_graph.rm(link)
+    # removing a segment also removes its links, the sweep below only catches leftovers
+    for name in [i for i in initial_graph.segment_names if i in remove_clusters]:
+        logger.debug(f"Removing {name}")
+        initial_graph.rm(initial_graph.segment(name))
+    doomed_links = [link for link in initial_graph.dovetails
+                    if link.to_name in remove_clusters or link.from_name in remove_clusters]
+    for link in doomed_links:
+        initial_graph.rm(link)
 
     initial_graph=gfa_ops.clean_graph(initial_graph)
     out_clusters = os.path.join(StRainyArgs().output_intermediate, "10_fine_clusters.gfa")
@@ -543,7 +610,13 @@ def transform_main(args):
     strainy_utgs = os.path.join(StRainyArgs().output, "strain_unitigs.gfa")
     shutil.copyfile(out_clusters, strainy_utgs)
 
-    phased_graph = gfapy.Gfa.from_file(out_clusters)    #parsing again because gfapy can"t copy
+    # the simplified graph is only written as an intermediate file, with --link-simplify or in debug mode.
+    # strain_contigs.gfa is always the merged graph
+    run_link_simplification = args.link_simplify or StRainyArgs().debug
+    if run_link_simplification:
+        phased_graph = gfapy.Gfa.from_file(out_clusters)    #parsing again because gfapy can"t copy
+    else:
+        phased_graph = initial_graph    #not used for anything else, merged in place
 
     segs_unmerged=phased_graph.segment_names
     gfapy.GraphOperations.merge_linear_paths(phased_graph)
@@ -556,15 +629,14 @@ def transform_main(args):
     strainy_final = os.path.join(StRainyArgs().output, "strain_contigs.gfa")
     shutil.copyfile(out_merged, strainy_final)
 
-    logger.info("### Simplify graph")
-    smpl.simplify_links(initial_graph)
-    gfapy.GraphOperations.merge_linear_paths(initial_graph)
-    initial_graph=gfa_ops.clean_graph(initial_graph)
+    if run_link_simplification:
+        logger.info("### Simplify graph")
+        smpl.simplify_links(initial_graph)
+        gfapy.GraphOperations.merge_linear_paths(initial_graph)
+        initial_graph=gfa_ops.clean_graph(initial_graph)
 
-    out_simplified = os.path.join(StRainyArgs().output_intermediate, "30_links_simplification.gfa")
-    gfapy.Gfa.to_file(initial_graph, out_simplified)
-    if args.link_simplify:
-        shutil.copyfile(out_merged, strainy_final)
+        out_simplified = os.path.join(StRainyArgs().output_intermediate, "30_links_simplification.gfa")
+        gfapy.Gfa.to_file(initial_graph, out_simplified)
 
     logger.info("Generating strain report")
     strains_report = os.path.join(StRainyArgs().output, "multiplicity_stats.txt")
@@ -586,7 +658,7 @@ def transform_main(args):
         seg_merged = [k for k in segs_merged if re.search(seg, k) != None][0]
         merged_clusters[seg] = seg_merged
 
-    for edge in StRainyArgs().edges:
+    for edge in edges:
         try:
             cl = pd.read_csv("%s/clusters/clusters_%s_%s_%s.csv" % (StRainyArgs().output_intermediate, edge, I, AF),
                          keep_default_na=False)
@@ -598,6 +670,6 @@ def transform_main(args):
             cl.to_csv("%s/clusters/clusters_%s_%s_%s_MERGED.csv" % (StRainyArgs().output_intermediate, edge, I, AF))
         except(FileNotFoundError): pass
         os.makedirs("%s/bam/merged/" % StRainyArgs().output_intermediate, exist_ok=True)
-    color_bam(StRainyArgs().edges, transfrom_stage=True)
+    color_bam(edges, transfrom_stage=True)
     flye_consensus.print_cache_statistics()
     logger.info("### Done!")
\ No newline at end of file
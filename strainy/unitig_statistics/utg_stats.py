@@ -2,7 +2,6 @@ import re
 import gfapy
 from collections import Counter, deque, defaultdict
 import pandas as pd
-import pysam
 import csv
 from strainy.params import *
 from strainy.clustering import build_data
@@ -63,11 +62,7 @@ def format_rounding(number):
 
 
 def store_phased_unitig_info(strain_unitig, reference_unitig, n_SNPs, start, end):
-    reference_coverage = round(float(pysam.samtools.coverage("-r",
-                                                             reference_unitig,
-                                                             StRainyArgs().bam,
-                                                             "--no-header").
-                                     split()[6]))
+    reference_coverage = round(build_data.unitig_coverage(StRainyArgs().bam, reference_unitig)[1])
     # # Log the information to std output
     # logger.info(f'== == Inserted Strain unitig: {strain_unitig.name} == == ')
     # logger.info(f'\t\t Reference unitig: {reference_unitig}')